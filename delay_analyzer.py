@@ -43,8 +43,7 @@ def transmission_delay(packet_size_bits, bandwidth_bps):
     Transmission Delay = Packet Size / Bandwidth
     """
     try:
-        delay = packet_size_bits / bandwidth_bps
-        return round(delay, 6)
+        return packet_size_bits / bandwidth_bps
     except ZeroDivisionError:
         return float('inf')
 
@@ -53,8 +52,7 @@ def propagation_delay(distance_km, propagation_speed_kmps):
     Propagation Delay = Distance / Propagation Speed
     """
     try:
-        delay = distance_km / propagation_speed_kmps
-        return round(delay, 6)
+        return distance_km / propagation_speed_kmps
     except ZeroDivisionError:
         return float('inf')
 
@@ -65,11 +63,11 @@ def congestion_delay(queue_length, avg_packet_arrival_rate, avg_packet_service_r
     try:
         if avg_packet_service_rate <= avg_packet_arrival_rate:
             return float('inf')  # Indicates infinite delay (congestion collapse)
-        delay = queue_length / (avg_packet_service_rate - avg_packet_arrival_rate)
-        return round(delay, 6)
+        return queue_length / (avg_packet_service_rate - avg_packet_arrival_rate)
     except ZeroDivisionError:
         return float('inf')
 
+@st.cache_data(max_entries=1024)
 def total_network_delay(packet_size_bits, bandwidth_bps, distance_km, propagation_speed_kmps,
                         queue_length, arrival_rate, service_rate):
     t_delay = transmission_delay(packet_size_bits, bandwidth_bps)
@@ -80,7 +78,7 @@ def total_network_delay(packet_size_bits, bandwidth_bps, distance_km, propagatio
         "Transmission Delay (sec)": t_delay,
         "Propagation Delay (sec)": p_delay,
         "Congestion Delay (sec)": c_delay,
-        "Total Delay (sec)": round(total, 6)
+        "Total Delay (sec)": total
     }
 
 # 🔧 Example usage
@@ -100,5 +98,5 @@ if __name__ == "__main__":
 
     print("Delay Report:")
     for k, v in delay_report.items():
-        print(f"{k}: {v} sec")
+        print(f"{k}: {v:.6f} sec")
 
@@ -1,144 +1,343 @@
-import random
-import math
-import statistics
+import argparse
+import numpy as np
 import pandas as pd
+import matplotlib
+matplotlib.use("Agg")   # headless: render to file, no GUI backend
 import matplotlib.pyplot as plt
-from collections import deque
+from joblib import Parallel, delayed, effective_n_jobs
+from numba import config, get_num_threads, njit, prange, set_num_threads
 
 # -------------------------------
-# Packet and Queue Simulation
+# Queue Simulation
 # -------------------------------
-class Packet:
-    def __init__(self, arrival_time):
-        self.arrival_time = arrival_time
-        self.start_service = None
-        self.departure_time = None
+# Service time distributions understood by simulate_queue
+SERVICE_EXPONENTIAL = 0
+SERVICE_DETERMINISTIC = 1
 
-def simulate_queue(arrival_rate, service_time_sampler, sim_time, max_packets=int(2e6)):
+# fastmath without the no-nans/no-infs flags: the event loop compares against inf
+FASTMATH = {'nsz', 'arcp', 'contract', 'afn', 'reassoc'}
+
+# Native-code options for the simulation kernels: C float semantics instead of
+# Python's ZeroDivisionError checks.
+KERNEL_OPTIONS = dict(cache=True, error_model='numpy')
+
+@njit(**KERNEL_OPTIONS)
+def _sample_block(rng, mean, distribution, size):
+    """
+    Draws a block of `size` samples with the given mean from `distribution`,
+    using the np.random.Generator `rng`.
     """
-    Simulates a single-server FIFO queue using discrete-event simulation.
-    Returns lists of total delays and queueing delays.
+    if distribution == SERVICE_DETERMINISTIC:
+        return np.full(size, mean)
+    return rng.exponential(mean, size)
+
+@njit(fastmath=FASTMATH, **KERNEL_OPTIONS)
+def simulate_queue(arrival_rate, service_time_mean, distribution, sim_time, rng, max_packets=int(2e6),
+                   tol=0.0, n_min=10_000):
+    """
+    Simulates a single-server FIFO queue (SERVICE_EXPONENTIAL or SERVICE_DETERMINISTIC
+    service, mean service_time_mean) and returns (mean total delay, mean queueing delay),
+    or (nan, 0.0) if nothing completed. With tol > 0 it stops once the 95% CI of the mean
+    delay is within tol * mean; that CI assumes independent delays, so it is too narrow
+    at high rho and tol is off by default.
     """
+    qarr = np.empty(max_packets, dtype=np.float64)   # arrival times of waiting packets
+    qhead = 0
+    qtail = 0
+    delay_mean = 0.0
+    delay_m2 = 0.0
+    q_sum = 0.0
+
+    # Never draw more than the packet cap allows; the refill below covers longer runs.
+    block = min(int(1.5 * arrival_rate * sim_time) + 1024, max_packets + 1)
+    arrival_mean = 1.0 / arrival_rate if arrival_rate > 0 else np.inf
+    inter_arrivals = _sample_block(rng, arrival_mean, SERVICE_EXPONENTIAL, block)
+    service_times = _sample_block(rng, service_time_mean, distribution, block)
+    ia_i = 0
+    sv_i = 0
+
     t = 0.0
-    next_arrival = random.expovariate(arrival_rate) if arrival_rate > 0 else float('inf')
-    queue = deque()
+    next_arrival = inter_arrivals[ia_i]
+    ia_i += 1
     server_busy = False
-    departure_time = float('inf')
-    packets_completed = []
-    current_serving = None
+    next_departure = np.inf
+    serving_arrival = 0.0
+    serving_start = 0.0
+    completed = 0
     packet_count = 0
 
     while t < sim_time and packet_count < max_packets:
-        if next_arrival <= departure_time and next_arrival <= sim_time:
+        if next_arrival <= next_departure and next_arrival <= sim_time:
             # ---- Arrival Event ----
             t = next_arrival
-            pkt = Packet(t)
             packet_count += 1
             if not server_busy:
                 # Start service immediately
-                pkt.start_service = t
-                service_time = service_time_sampler()
-                pkt.departure_time = t + service_time
-                departure_time = pkt.departure_time
-                current_serving = pkt
+                serving_arrival = t
+                serving_start = t
+                if sv_i == block:
+                    service_times = _sample_block(rng, service_time_mean, distribution, block)
+                    sv_i = 0
+                next_departure = t + service_times[sv_i]
+                sv_i += 1
                 server_busy = True
             else:
-                queue.append(pkt)
-            next_arrival = t + random.expovariate(arrival_rate)
+                qarr[qtail] = t
+                qtail += 1
+            if ia_i == block:
+                inter_arrivals = _sample_block(rng, arrival_mean, SERVICE_EXPONENTIAL, block)
+                ia_i = 0
+            next_arrival = t + inter_arrivals[ia_i]
+            ia_i += 1
         else:
             # ---- Departure Event ----
-            if departure_time > sim_time:
+            if next_departure > sim_time:
                 break
-            t = departure_time
-            if current_serving is not None:
-                packets_completed.append(current_serving)
-            if queue:
-                next_pkt = queue.popleft()
-                next_pkt.start_service = t
-                service_time = service_time_sampler()
-                next_pkt.departure_time = t + service_time
-                departure_time = next_pkt.departure_time
-                current_serving = next_pkt
-                server_busy = True
+            t = next_departure
+            d = t - serving_arrival
+            completed += 1
+            delta = d - delay_mean
+            delay_mean += delta / completed
+            delay_m2 += delta * (d - delay_mean)
+            q_sum += serving_start - serving_arrival
+            if qhead != qtail:
+                serving_arrival = qarr[qhead]
+                qhead += 1
+                serving_start = t
+                if sv_i == block:
+                    service_times = _sample_block(rng, service_time_mean, distribution, block)
+                    sv_i = 0
+                next_departure = t + service_times[sv_i]
+                sv_i += 1
             else:
                 server_busy = False
-                departure_time = float('inf')
-                current_serving = None
-
-    # ---- Collect Results ----
-    delays = []
-    queueing_times = []
-    for p in packets_completed:
-        total_delay = p.departure_time - p.arrival_time
-        q_delay = p.start_service - p.arrival_time if p.start_service else 0.0
-        delays.append(total_delay)
-        queueing_times.append(q_delay)
-    return delays, queueing_times
+                next_departure = np.inf
+            # Welford running variance; check convergence every 1024 departures past n_min
+            if tol > 0.0 and completed >= n_min and completed % 1024 == 0:
+                se = np.sqrt(delay_m2 / (completed * (completed - 1)))
+                if 1.96 * se < tol * delay_mean:
+                    break
+
+    if completed == 0:
+        return np.nan, 0.0
+    return delay_mean, q_sum / completed
+
+@njit(fastmath=FASTMATH, **KERNEL_OPTIONS)
+def _lindley_row(inter_arrivals, service_times, service_time):
+    """
+    Lindley's recursion W[k+1] = max(W[k] + S[k] - A[k+1], 0) over one run, where
+    S[k] is service_times[k], or the constant service_time if service_times is empty.
+    Returns (mean total delay, mean queueing delay).
+    """
+    n = len(inter_arrivals)
+    deterministic = len(service_times) == 0
+    w = 0.0
+    wait_sum = 0.0
+    s = service_time if deterministic else service_times[0]
+    service_sum = s
+    for k in range(1, n):
+        w = max(w + s - inter_arrivals[k], 0.0)
+        wait_sum += w
+        s = service_time if deterministic else service_times[k]
+        service_sum += s
+    return (wait_sum + service_sum) / n, wait_sum / n
+
+@njit(fastmath=FASTMATH, **KERNEL_OPTIONS)
+def simulate_md1(arrival_rate, service_time_mean, sim_time, rng, max_packets=int(2e6)):
+    """
+    M/D/1 specialization of simulate_queue. With constant service time D the queue
+    reduces to Lindley's recursion W[k+1] = max(W[k] + D - A[k+1], 0) over pre-drawn
+    inter-arrival times from `rng`, with no event list. Covers the packets expected
+    in sim_time, at most max_packets. Returns (mean total delay, mean queueing delay), or (nan, 0.0) like
+    simulate_queue when fewer than one packet is expected to arrive.
+    """
+    n = min(int(arrival_rate * sim_time), max_packets)
+    if n < 1:
+        return np.nan, 0.0
+    inter_arrivals = _sample_block(rng, 1.0 / arrival_rate, SERVICE_EXPONENTIAL, n)
+    return _lindley_row(inter_arrivals, np.empty(0), service_time_mean)
+
+@njit(parallel=True, fastmath=FASTMATH, **KERNEL_OPTIONS)
+def _lindley_means(inter_arrivals, service_times, service_time):
+    """
+    Runs _lindley_row on each row (one replication per row, rows in parallel).
+    Pass a (replications, 0) service_times array for constant service.
+    Returns per-replication mean total delays and mean queueing delays.
+    """
+    replications = inter_arrivals.shape[0]
+    mean_total = np.empty(replications, dtype=np.float64)
+    mean_queue = np.empty(replications, dtype=np.float64)
+    for r in prange(replications):
+        mean_total[r], mean_queue[r] = _lindley_row(inter_arrivals[r], service_times[r], service_time)
+    return mean_total, mean_queue
+
+def simulate_replications(arrival_rate, service_time_mean, distribution, sim_time, replications, rng=None,
+                          max_packets=int(2e6), max_batch_bytes=2**30):
+    """
+    Runs `replications` independent single-server FIFO queues as batches of
+    (replications, packets) arrays of inter-arrival and service times, with waiting
+    times from Lindley's recursion. Each replication covers the packets expected in
+    sim_time, at most max_packets; replications are split into chunks so no batch
+    holds more than max_batch_bytes of samples.
+    Returns (mean total delay, mean queueing delay), or (nan, 0.0) like
+    simulate_queue when fewer than one packet is expected to arrive.
+    """
+    n = min(int(arrival_rate * sim_time), max_packets)
+    if n < 1:
+        return np.nan, 0.0
+    rng = np.random.default_rng() if rng is None else rng
+    deterministic = distribution == SERVICE_DETERMINISTIC
+    row_bytes = n * 8 * (1 if deterministic else 2)
+    chunk = max(1, min(replications, max_batch_bytes // row_bytes))
+
+    totals = []
+    queues = []
+    for start in range(0, replications, chunk):
+        shape = (min(chunk, replications - start), n)
+        inter_arrivals = rng.exponential(1.0 / arrival_rate, shape)
+        if deterministic:
+            service_times = np.empty((shape[0], 0))
+        else:
+            service_times = rng.exponential(service_time_mean, shape)
+        mean_total, mean_queue = _lindley_means(inter_arrivals, service_times, service_time_mean)
+        totals.append(mean_total)
+        queues.append(mean_queue)
+    return np.concatenate(totals).mean(), np.concatenate(queues).mean()
+
+# -------------------------------
+# Analytic Queueing Models
+# -------------------------------
+def analytic_mg1(arrival_rate, service_rate, service_scv):
+    """
+    Pollaczek-Khinchine mean delays for a single-server M/G/1 queue.
+    service_scv is the squared coefficient of variation of the service time
+    (sigma^2 * mu^2): 1 for exponential service, 0 for deterministic service.
+    L = rho + rho^2 (1 + sigma^2 mu^2) / (2 (1 - rho)), W = L / lambda (Little's law).
+    Accepts scalars (returning NumPy float scalars) or NumPy arrays of arrival rates.
+    Returns (mean total delay, mean queueing delay); both are inf where rho >= 1.
+    """
+    arrival_rate = np.asarray(arrival_rate, dtype=float)
+    # mu (1 - rho) == mu - lambda, so Wq = (1 + scv)/2 * rho/(mu - lambda)
+    rho = arrival_rate / service_rate
+    den = service_rate - arrival_rate
+    with np.errstate(divide='ignore', invalid='ignore'):
+        queue_delay = np.where(den > 0, (0.5 * (1.0 + service_scv)) * rho / den, np.inf)[()]
+    return queue_delay + 1.0 / service_rate, queue_delay
+
+def analytic_mm1(arrival_rate, service_rate):
+    """
+    M/M/1: W = 1/(mu - lambda), Wq = rho/(mu - lambda).
+    """
+    return analytic_mg1(arrival_rate, service_rate, 1.0)
+
+def analytic_md1(arrival_rate, service_rate):
+    """
+    M/D/1: W = 1/mu + rho/(2 mu (1 - rho)).
+    """
+    return analytic_mg1(arrival_rate, service_rate, 0.0)
 
 # -------------------------------
 # Experiment Runner
 # -------------------------------
-def run_experiments(packet_size_bytes=1500, bandwidth_bps=10_000_000, rho_list=None, sim_time=120.0):
+# Result columns filled from _one_rho, in the order it returns them
+SIM_COLUMNS = ("sim_total_mm1_s", "sim_queue_mm1_s", "sim_total_md1_s", "sim_queue_md1_s")
+
+def _one_rho(arrival_rate, service_time_mean, sim_time, rng, replications=1, tol=0.0, num_threads=None):
     """
-    Runs simulations for M/M/1 and M/D/1 queues at different utilization (rho).
+    Simulates M/M/1 and M/D/1 at a single utilization with its own Generator.
+    With replications > 1 the means come from simulate_replications instead of
+    a single run (event-driven for M/M/1, stopping early per `tol`; simulate_md1 for M/D/1).
+    `tol` is not used by the batched path.
+    num_threads caps the Numba threads the batched kernels use in this call.
+    Returns the mean simulated delays in SIM_COLUMNS order.
+    """
+    if replications > 1:
+        previous_threads = get_num_threads()
+        if num_threads is not None:
+            set_num_threads(min(num_threads, config.NUMBA_NUM_THREADS))
+        try:
+            total_mm, queue_mm = simulate_replications(arrival_rate, service_time_mean, SERVICE_EXPONENTIAL,
+                                                       sim_time, replications, rng)
+            total_md, queue_md = simulate_replications(arrival_rate, service_time_mean, SERVICE_DETERMINISTIC,
+                                                       sim_time, replications, rng)
+        finally:
+            set_num_threads(previous_threads)
+        return total_mm, queue_mm, total_md, queue_md
+
+    total_mm, queue_mm = simulate_queue(arrival_rate, service_time_mean, SERVICE_EXPONENTIAL, sim_time, rng,
+                                        tol=tol)
+    total_md, queue_md = simulate_md1(arrival_rate, service_time_mean, sim_time, rng)
+    return total_mm, queue_mm, total_md, queue_md
+
+def run_experiments(packet_size_bytes=1500, bandwidth_bps=10_000_000, rho_list=None, sim_time=120.0,
+                    validate=False, rng=None, n_jobs=-1, replications=1, tol=0.0):
+    """
+    Computes mean delays for M/M/1 and M/D/1 queues at different utilization (rho).
+    Means come from the closed-form results, which are exact for both models.
+    With validate=True each point is also simulated (sim_* columns) to check them,
+    averaged over `replications` independent runs;
+    the rho points run in parallel on n_jobs processes, each with an independent
+    PCG64 Generator spawned from `rng` (a seed or np.random.Generator). The cores
+    are split between processes and the Numba threads of the batched replication
+    kernels, so the two levels of parallelism do not oversubscribe the machine.
+    tol is simulate_queue's early stopping and only affects the sim_*_mm1_s columns
+    with replications=1 (ValueError otherwise).
     Returns results in a Pandas DataFrame.
     """
+    if tol > 0 and replications > 1:
+        raise ValueError("tol (early stopping) cannot be combined with replications > 1")
     if rho_list is None:
         rho_list = [i/20 for i in range(1, 20)]  # 0.05 .. 0.95
 
+    # Every rho point shares the same server, so mu and the service time are
+    # computed once and only lambda varies across the sweep (PDQ "Method A").
     L_bits = packet_size_bytes * 8
     service_rate_packets = bandwidth_bps / L_bits   # mu (pkts/s)
     service_time_mean = 1.0 / service_rate_packets  # mean transmission time
 
-    rows = []
-    for rho in rho_list:
-        arrival_rate = rho * service_rate_packets   # λ = ρ * μ
-
-        # Service samplers
-        mm1_sampler = lambda: random.expovariate(1.0 / service_time_mean)  # exponential
-        md1_sampler = lambda: service_time_mean                           # deterministic
-
-        # Simulate
-        delays_mm, q_mm = simulate_queue(arrival_rate, mm1_sampler, sim_time)
-        delays_md, q_md = simulate_queue(arrival_rate, md1_sampler, sim_time)
-
-        mean_total_mm = statistics.mean(delays_mm) if delays_mm else float('nan')
-        mean_queue_mm = statistics.mean(q_mm) if q_mm else 0.0
-        mean_total_md = statistics.mean(delays_md) if delays_md else float('nan')
-        mean_queue_md = statistics.mean(q_md) if q_md else 0.0
-
-        # Analytic M/M/1
-        mu = service_rate_packets
-        lam = arrival_rate
-        if lam < mu:
-            analytic_total = 1.0 / (mu - lam)
-            analytic_queue = rho / (mu - lam)
-        else:
-            analytic_total = float('inf')
-            analytic_queue = float('inf')
-
-        rows.append({
-            "rho": rho,
-            "arrival_rate_pkts_s": arrival_rate,
-            "service_rate_pkts_s": service_rate_packets,
-            "tx_delay_s": service_time_mean,
-            "sim_total_mm1_s": mean_total_mm,
-            "sim_queue_mm1_s": mean_queue_mm,
-            "sim_total_md1_s": mean_total_md,
-            "sim_queue_md1_s": mean_queue_md,
-            "analytic_mm1_total_s": analytic_total,
-            "analytic_mm1_queue_s": analytic_queue
-        })
-
-    return pd.DataFrame(rows)
+    rho = np.asarray(rho_list, dtype=float)
+    arrival_rate = rho * service_rate_packets   # λ = ρ * μ
+
+    # Analytic M/M/1 and M/D/1
+    analytic_total_mm, analytic_queue_mm = analytic_mm1(arrival_rate, service_rate_packets)
+    analytic_total_md, analytic_queue_md = analytic_md1(arrival_rate, service_rate_packets)
+
+    cols = {
+        "rho": rho,
+        "arrival_rate_pkts_s": arrival_rate,
+        "service_rate_pkts_s": np.full_like(rho, service_rate_packets),
+        "tx_delay_s": np.full_like(rho, service_time_mean),
+    }
+
+    if validate:
+        streams = np.random.default_rng(rng).spawn(len(rho))
+        threads_per_job = max(1, config.NUMBA_NUM_THREADS // effective_n_jobs(n_jobs))
+        sims = Parallel(n_jobs=n_jobs)(
+            delayed(_one_rho)(lam, service_time_mean, sim_time, stream, replications, tol, threads_per_job)
+            for lam, stream in zip(arrival_rate, streams))
+        sim = np.array(sims, dtype=np.float64).reshape(len(rho), len(SIM_COLUMNS))
+        cols.update({name: sim[:, i] for i, name in enumerate(SIM_COLUMNS)})
+
+    cols.update({
+        "analytic_mm1_total_s": analytic_total_mm,
+        "analytic_mm1_queue_s": analytic_queue_mm,
+        "analytic_md1_total_s": analytic_total_md,
+        "analytic_md1_queue_s": analytic_queue_md
+    })
+
+    return pd.DataFrame(cols)
 
 # -------------------------------
 # Main Script
 # -------------------------------
 if __name__ == "__main__":
-    random.seed(42)
+    parser = argparse.ArgumentParser(description="Transmission vs Congestion Delay Analyzer")
+    parser.add_argument("--csv", action="store_true", help="save results as CSV instead of Parquet")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
     rho_values = [i/25 for i in range(1, 25)]  # 0.04 .. 0.96
-    df = run_experiments(rho_list=rho_values, sim_time=100.0)
+    df = run_experiments(rho_list=rho_values, sim_time=100.0, validate=True, rng=rng)
 
     # Show first rows
     print(df.head(10))
@@ -148,14 +347,20 @@ if __name__ == "__main__":
     plt.plot(df['rho'], df['sim_total_mm1_s'], label='Simulated M/M/1')
     plt.plot(df['rho'], df['sim_total_md1_s'], label='Simulated M/D/1')
     plt.plot(df['rho'], df['analytic_mm1_total_s'], '--', label='Analytic M/M/1')
+    plt.plot(df['rho'], df['analytic_md1_total_s'], '--', label='Analytic M/D/1')
     plt.xlabel('Utilization (ρ)')
     plt.ylabel('Average Total Delay (seconds)')
     plt.title('Transmission vs Congestion Delay Analyzer')
     plt.legend()
     plt.grid(True)
     plt.tight_layout()
-    plt.show()
+    plt.savefig("delays.png", dpi=100)
+    print("Plot saved to delays.png")
 
     # Save results
-    df.to_csv("transmission_vs_congestion.csv", index=False)
-    print("Results saved to transmission_vs_congestion.csv")
+    if args.csv:
+        df.to_csv("transmission_vs_congestion.csv", index=False)
+        print("Results saved to transmission_vs_congestion.csv")
+    else:
+        df.to_parquet("transmission_vs_congestion.parquet", engine="pyarrow", compression="zstd")
+        print("Results saved to transmission_vs_congestion.parquet")